@@ -1,9 +1,13 @@
 import os
-import shutil
+import json
 import tempfile
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import JSONResponse, FileResponse
+from starlette.background import BackgroundTask
+from starlette.concurrency import run_in_threadpool
 from pipeline import run_pdf_pipeline
+from uploads import UploadRejected, check_content_length, hash_upload, check_page_limit, spooled_upload_path
+import storage
 from model_chain import get_qa_chain
 import base64
 
@@ -12,6 +16,19 @@ app = FastAPI()
 # In-memory store for retrievers
 retrievers = {}
 
+# Content hash + pipeline options -> session_id, so re-uploads reuse the session
+sessions_by_hash = {}
+
+@app.middleware("http")
+async def reject_oversized_uploads(request: Request, call_next):
+    """Fail fast on oversized uploads, before Starlette reads the multipart body."""
+    if request.method == "POST" and request.url.path in ("/upload_pdf/", "/sessions/import/"):
+        try:
+            check_content_length(request.headers)
+        except UploadRejected as e:
+            return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    return await call_next(request)
+
 def load_existing_retriever(session_id):
     """Load a retriever from disk based on session_id"""
     try:
@@ -31,7 +48,7 @@ def load_existing_retriever(session_id):
         from langchain.retrievers.multi_vector import MultiVectorRetriever
         
         vectorstore = Chroma(
-            collection_name=f"multi-model-rag-{session_id}",  # Make collection name unique per session
+            collection_name=collection_name,
             embedding_function=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2'),
             persist_directory="./chroma_db"
         )
@@ -41,9 +58,23 @@ def load_existing_retriever(session_id):
         id_key = "doc_id"
         retriever = MultiVectorRetriever(vectorstore=vectorstore, docstore=store, id_key=id_key)
         
-        # Note: In a production environment, you'd need to reload the documents into docstore
-        # This simplified version will work for vector similarity search but might not 
-        # return full document content properly
+        # Reload the persisted docstore so full document content is returned
+        docstore_path = f"./chroma_db/{session_id}_docstore.json"
+        if os.path.exists(docstore_path):
+            from langchain_core.documents import Document
+            with open(docstore_path, "r") as f:
+                docstore = json.load(f)
+            docs = dict(docstore["documents"])
+
+            # Image entries are rebuilt from _images.txt, in the order they were stored
+            image_file_path = f"./chroma_db/{session_id}_images.txt"
+            if docstore["image_ids"] and os.path.exists(image_file_path):
+                with open(image_file_path, "r") as f:
+                    images = [img.strip() for img in f.read().split("---IMAGE_SEPARATOR---") if img.strip()]
+                docs.update(zip(docstore["image_ids"], images))
+
+            store.mset([(doc_id, Document(page_content=content, metadata={id_key: doc_id}))
+                        for doc_id, content in docs.items()])
         
         return retriever
     except Exception as e:
@@ -61,14 +92,10 @@ async def upload_pdf(
     new_after_n_chars: int = Form(6000)
 ):
     try:
-        # Save file temporarily
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-            shutil.copyfileobj(file.file, tmp)
-            tmp_path = tmp.name
-
-        # Run pipeline
-        retriever, session_id = run_pdf_pipeline(
-            tmp_path,
+        # Hash and validate the upload where Starlette spooled it, without copying it again
+        content_hash, _ = await hash_upload(file)
+
+        pipeline_options = dict(
             infer_table_structure=infer_table_structure,
             strategy=strategy,
             chunking_strategy=chunking_strategy,
@@ -76,13 +103,34 @@ async def upload_pdf(
             combine_text_under_n_chars=combine_text_under_n_chars,
             new_after_n_chars=new_after_n_chars,
         )
+        dedup_key = (content_hash, tuple(sorted(pipeline_options.items())))
+        existing_session = sessions_by_hash.get(dedup_key)
+        if existing_session in retrievers:
+            return JSONResponse(content={
+                "message": "File already processed.",
+                "session_id": existing_session,
+            })
+
+        await check_page_limit(file.file)
+
+        # Run pipeline off the event loop, partitioning straight from Starlette's spool file
+        pdf_path = spooled_upload_path(file)
+        source = {"file_path": pdf_path} if pdf_path else {"file": file.file}
+        retriever, session_id = await run_in_threadpool(
+            run_pdf_pipeline, **source, **pipeline_options
+        )
 
         retrievers[session_id] = retriever
+        sessions_by_hash[dedup_key] = session_id
 
         return JSONResponse(content={"message": "File processed successfully.", "session_id": session_id})
 
+    except UploadRejected as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        await file.close()
 
 @app.post("/ask_question/")
 async def ask_question(session_id: str = Form(...), question: str = Form(...)):
@@ -190,4 +238,84 @@ async def ask_question(session_id: str = Form(...), question: str = Form(...)):
         })
         
     except Exception as e:
-        return JSONResponse(status_code=500, content={"error": str(e)})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+
+def forget_session(session_id):
+    """Drop any in-memory state held for a session."""
+    retrievers.pop(session_id, None)
+    globals().get("memories", {}).pop(session_id, None)
+    for key, value in list(sessions_by_hash.items()):
+        if value == session_id:
+            del sessions_by_hash[key]
+
+@app.get("/sessions/")
+async def list_sessions():
+    try:
+        sessions = await run_in_threadpool(storage.list_sessions)
+        return JSONResponse(content={"sessions": sessions})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.delete("/sessions/{session_id}")
+async def delete_session(session_id: str):
+    try:
+        await run_in_threadpool(storage.delete_session, session_id)
+        forget_session(session_id)
+        return JSONResponse(content={"message": "Session deleted.", "session_id": session_id})
+    except storage.StorageError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/sessions/expire/")
+async def expire_sessions(max_age_hours: float = Form(...)):
+    try:
+        expired, failed = await run_in_threadpool(storage.expire_sessions, max_age_hours * 3600)
+        for session_id in expired:
+            forget_session(session_id)
+        return JSONResponse(content={"expired": expired, "failed": failed})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.post("/storage/compact/")
+async def compact_storage():
+    try:
+        removed = await run_in_threadpool(storage.compact)
+        return JSONResponse(content={"removed": removed})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/sessions/{session_id}/export")
+async def export_session(session_id: str):
+    fd, archive_path = tempfile.mkstemp(suffix=".zip")
+    os.close(fd)
+    try:
+        await run_in_threadpool(storage.export_session, session_id, archive_path)
+    except Exception as e:
+        os.remove(archive_path)
+        status_code = e.status_code if isinstance(e, storage.StorageError) else 500
+        return JSONResponse(status_code=status_code, content={"error": str(e)})
+    return FileResponse(
+        archive_path,
+        media_type="application/zip",
+        filename=f"session-{session_id}.zip",
+        background=BackgroundTask(os.remove, archive_path),
+    )
+
+@app.post("/sessions/import/")
+async def import_session(file: UploadFile = File(...)):
+    fd, archive_path = tempfile.mkstemp(suffix=".zip")
+    try:
+        with os.fdopen(fd, "wb") as out:
+            while chunk := await file.read(1024 * 1024):
+                await run_in_threadpool(out.write, chunk)
+        session_id = await run_in_threadpool(storage.import_session, archive_path)
+        return JSONResponse(content={"message": "Session imported.", "session_id": session_id})
+    except storage.StorageError as e:
+        return JSONResponse(status_code=e.status_code, content={"error": str(e)})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"error": str(e)})
+    finally:
+        os.remove(archive_path)
+        await file.close()
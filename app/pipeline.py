@@ -1,6 +1,6 @@
 import os
+import json
 import uuid
-import re
 from unstructured.partition.pdf import partition_pdf
 from unstructured.documents.elements import Table
 from langchain_chroma import Chroma
@@ -10,41 +10,10 @@ from langchain_huggingface import HuggingFaceEmbeddings
 from langchain.retrievers.multi_vector import MultiVectorRetriever
 
 from utils import get_images_base64
+from storage import storage_lock, sanitize_collection_name
 from model_chain import get_summarize_chain_groq, get_image_description_chain
 
 
-def sanitize_collection_name(name):
-    """
-    Ensure collection name meets Chroma's requirements:
-    1. Contains 3-63 characters
-    2. Starts and ends with an alphanumeric character
-    3. Otherwise contains only alphanumeric characters, underscores or hyphens
-    4. Contains no two consecutive periods
-    5. Is not a valid IPv4 address
-    """
-    # Remove any non-alphanumeric characters except underscores and hyphens
-    name = re.sub(r'[^a-zA-Z0-9_\-]', '', name)
-    
-    # Ensure it starts and ends with alphanumeric
-    if not name[0].isalnum():
-        name = 'a' + name
-    if not name[-1].isalnum():
-        name = name + 'z'
-    
-    # Ensure minimum length of 3
-    while len(name) < 3:
-        name += 'x'
-    
-    # Ensure maximum length of 63
-    if len(name) > 63:
-        name = name[:63]
-        # Make sure it still ends with alphanumeric
-        if not name[-1].isalnum():
-            name = name[:-1] + 'z'
-    
-    return name
-
-
 def find_closest_text_to_image(chunks, img):
     """Find text chunks that are close to an image in the document"""
     # This is a simplified approach - in reality, you'd need to analyze the PDF structure
@@ -63,7 +32,8 @@ def find_closest_text_to_image(chunks, img):
     return ""
 
 def run_pdf_pipeline(
-    file_path,
+    file_path=None,
+    file=None,
     infer_table_structure=True,
     strategy="hi_res",
     extract_image_block_types=["image"],
@@ -75,6 +45,7 @@ def run_pdf_pipeline(
 ):
     chunks = partition_pdf(
         filename=file_path,
+        file=file,
         infer_table_structure=infer_table_structure,
         strategy=strategy,
         extract_image_block_types=extract_image_block_types,
@@ -131,23 +102,26 @@ def run_pdf_pipeline(
             continue
 
     # Generate a session ID - use UUID for reliable uniqueness
-    raw_session_id = os.path.basename(file_path).replace(".pdf", "")
     session_id = str(uuid.uuid4())[:8]  # Use first 8 chars of UUID for cleaner ID
     
     # Create a valid collection name
     collection_name = sanitize_collection_name(f"pdf-{session_id}")
     
-    # Save the collection name for future retrieval
-    os.makedirs("./chroma_db", exist_ok=True)
-    with open(f"./chroma_db/{session_id}_info.txt", "w") as f:
-        f.write(collection_name)
+    embeddings = HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2')
+
+    # Hold the storage lock so compaction never sees an _info.txt without its collection
+    with storage_lock:
+        # Save the collection name for future retrieval
+        os.makedirs("./chroma_db", exist_ok=True)
+        with open(f"./chroma_db/{session_id}_info.txt", "w") as f:
+            f.write(collection_name)
     
-    # Setup vectorstore with proper collection name
-    vectorstore = Chroma(
-        collection_name=collection_name,
-        embedding_function=HuggingFaceEmbeddings(model_name='sentence-transformers/all-MiniLM-L6-v2'),
-        persist_directory="./chroma_db"
-    )
+        # Setup vectorstore with proper collection name
+        vectorstore = Chroma(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory="./chroma_db"
+        )
 
     store = InMemoryStore()
     id_key = "doc_id"
@@ -174,6 +148,15 @@ def run_pdf_pipeline(
     store.mset([(img_id, Document(page_content=img, metadata={"doc_id": img_id})) 
             for img_id, img in zip(img_ids, images)])
 
+    # Persist the docstore so the session can be reloaded or exported later.
+    # Image content already lives in _images.txt, so only their ids are kept here.
+    doc_keys = doc_ids + table_ids
+    with open(f"./chroma_db/{session_id}_docstore.json", "w") as f:
+        json.dump({
+            "documents": {doc_id: doc.page_content for doc_id, doc in zip(doc_keys, store.mget(doc_keys))},
+            "image_ids": img_ids,
+        }, f)
+
     # Also store images in a separate file for easy access from streamlit
     if images:
         with open(f"./chroma_db/{session_id}_images.txt", "w") as f:
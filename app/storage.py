@@ -0,0 +1,419 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import zipfile
+import tempfile
+import functools
+import threading
+
+CHROMA_DIR = "./chroma_db"
+EMBEDDING_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+ARCHIVE_VERSION = 1
+
+# Session ids are the first 8 hex chars of a uuid4, see run_pdf_pipeline
+SESSION_ID_PATTERN = re.compile(r"^[0-9a-f]{8}$")
+
+# compact() leaves unreferenced directories younger than this alone
+SEGMENT_GRACE_SECONDS = 300
+
+# Largest archive member import_session() will decompress
+MAX_ARCHIVE_MEMBER_BYTES = int(os.getenv("MAX_ARCHIVE_MEMBER_MB", "500")) * 1024 * 1024
+
+# Held while sessions are created, deleted, imported or compacted.
+# This is a per-process lock: it does not protect chroma_db shared by several uvicorn workers.
+storage_lock = threading.RLock()
+
+# Per-session sidecar files kept next to the Chroma database
+SESSION_FILE_SUFFIXES = ("_info.txt", "_images.txt", "_docstore.json")
+
+
+class StorageError(Exception):
+    """Raised for storage operations that cannot be completed; carries the HTTP status."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+_client = None
+
+
+def sanitize_collection_name(name):
+    """
+    Ensure collection name meets Chroma's requirements:
+    1. Contains 3-63 characters
+    2. Starts and ends with an alphanumeric character
+    3. Otherwise contains only alphanumeric characters, underscores or hyphens
+    4. Contains no two consecutive periods
+    5. Is not a valid IPv4 address
+    """
+    # Remove any non-alphanumeric characters except underscores and hyphens
+    name = re.sub(r'[^a-zA-Z0-9_\-]', '', name)
+    
+    # Ensure it starts and ends with alphanumeric
+    if not name[0].isalnum():
+        name = 'a' + name
+    if not name[-1].isalnum():
+        name = name + 'z'
+    
+    # Ensure minimum length of 3
+    while len(name) < 3:
+        name += 'x'
+    
+    # Ensure maximum length of 63
+    if len(name) > 63:
+        name = name[:63]
+        # Make sure it still ends with alphanumeric
+        if not name[-1].isalnum():
+            name = name[:-1] + 'z'
+    
+    return name
+
+
+def _locked(func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with storage_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def get_client():
+    """Shared Chroma client, so every caller sees the same open database."""
+    global _client
+    if _client is None:
+        from chromadb import PersistentClient
+        _client = PersistentClient(path=CHROMA_DIR)
+    return _client
+
+
+def session_path(session_id, suffix):
+    return os.path.join(CHROMA_DIR, f"{session_id}{suffix}")
+
+
+def read_collection_name(session_id):
+    """Return the collection name recorded for a session, or None if missing/empty."""
+    info_path = session_path(session_id, "_info.txt")
+    if not os.path.exists(info_path):
+        return None
+    with open(info_path, "r") as f:
+        return f.read().strip() or None
+
+
+def _segment_dirs_by_collection():
+    """Map collection name -> HNSW segment directories, read from Chroma's sqlite catalogue."""
+    db_path = os.path.join(CHROMA_DIR, "chroma.sqlite3")
+    mapping = {}
+    if not os.path.exists(db_path):
+        return mapping
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        rows = conn.execute(
+            "SELECT s.id, c.name FROM segments s JOIN collections c ON s.collection = c.id "
+            "WHERE s.scope = 'VECTOR'"
+        ).fetchall()
+    finally:
+        conn.close()
+    for segment_id, name in rows:
+        mapping.setdefault(name, []).append(os.path.join(CHROMA_DIR, segment_id))
+    return mapping
+
+
+def _path_size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def _session_ids():
+    if not os.path.isdir(CHROMA_DIR):
+        return []
+    return sorted(
+        name[: -len("_info.txt")] for name in os.listdir(CHROMA_DIR) if name.endswith("_info.txt")
+    )
+
+
+@_locked
+def list_sessions():
+    """List stored sessions with their on-disk size and last-modified time."""
+    segments = _segment_dirs_by_collection()
+    sessions = []
+    for session_id in _session_ids():
+        collection_name = read_collection_name(session_id)
+        paths = [session_path(session_id, s) for s in SESSION_FILE_SUFFIXES]
+        paths = [p for p in paths if os.path.exists(p)]
+        paths += [d for d in segments.get(collection_name, []) if os.path.isdir(d)]
+        sessions.append({
+            "session_id": session_id,
+            "collection_name": collection_name,
+            "size_bytes": sum(_path_size(p) for p in paths),
+            "modified": max(os.path.getmtime(p) for p in paths),
+        })
+    return sessions
+
+
+@_locked
+def delete_session(session_id):
+    """
+    Delete a session's collection and sidecar files.
+    The files are first moved aside so a failed collection delete can be rolled back.
+    """
+    paths = [session_path(session_id, s) for s in SESSION_FILE_SUFFIXES]
+    paths = [p for p in paths if os.path.exists(p)]
+    if not paths:
+        raise StorageError(f"Unknown session_id: {session_id}", status_code=404)
+
+    collection_name = read_collection_name(session_id)
+    segment_dirs = _segment_dirs_by_collection().get(collection_name, [])
+    staging = tempfile.mkdtemp(prefix=".trash-", dir=CHROMA_DIR)
+    moved = []
+    try:
+        for path in paths:
+            target = os.path.join(staging, os.path.basename(path))
+            os.replace(path, target)
+            moved.append((path, target))
+        if collection_name:
+            client = get_client()
+            if collection_name in _collection_names(client):
+                client.delete_collection(collection_name)
+    except Exception:
+        for path, target in moved:
+            os.replace(target, path)
+        raise
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    # Chroma does not always remove the HNSW files of a deleted collection
+    for segment_dir in segment_dirs:
+        shutil.rmtree(segment_dir, ignore_errors=True)
+
+
+def expire_sessions(max_age_seconds):
+    """
+    Delete every session not modified within max_age_seconds.
+    Returns (deleted_ids, failures) where failures maps session_id -> error message.
+    """
+    cutoff = time.time() - max_age_seconds
+    deleted, failures = [], {}
+    for session in list_sessions():
+        if session["modified"] >= cutoff:
+            continue
+        try:
+            delete_session(session["session_id"])
+            deleted.append(session["session_id"])
+        except Exception as e:
+            failures[session["session_id"]] = str(e)
+    return deleted, failures
+
+
+def _collection_names(client):
+    names = []
+    for collection in client.list_collections():
+        # chromadb < 0.6 returns Collection objects, later versions return names
+        names.append(getattr(collection, "name", collection))
+    return names
+
+
+@_locked
+def compact():
+    """
+    Remove storage nobody references: empty or dangling _info.txt files,
+    sidecars without a session, collections no _info.txt points at, and
+    unreferenced directories (orphaned HNSW segments, leftover trash from a
+    crashed delete) older than SEGMENT_GRACE_SECONDS. Then VACUUM the sqlite
+    catalogue.
+    """
+    removed = []
+    if not os.path.isdir(CHROMA_DIR):
+        return removed
+
+    client = get_client()
+    collections = set(_collection_names(client))
+    live_sessions, referenced = set(), set()
+    for session_id in _session_ids():
+        collection_name = read_collection_name(session_id)
+        if collection_name in collections:
+            live_sessions.add(session_id)
+            referenced.add(collection_name)
+        else:
+            info_path = session_path(session_id, "_info.txt")
+            os.remove(info_path)
+            removed.append(info_path)
+
+    for suffix in SESSION_FILE_SUFFIXES[1:]:
+        for name in os.listdir(CHROMA_DIR):
+            if name.endswith(suffix) and name[: -len(suffix)] not in live_sessions:
+                path = os.path.join(CHROMA_DIR, name)
+                os.remove(path)
+                removed.append(path)
+
+    segments = _segment_dirs_by_collection()
+    for collection_name in sorted(collections - referenced):
+        client.delete_collection(collection_name)
+        removed.append(f"collection:{collection_name}")
+        for segment_dir in segments.get(collection_name, []):
+            if os.path.isdir(segment_dir):
+                shutil.rmtree(segment_dir)
+                removed.append(segment_dir)
+
+    live_segments = {os.path.basename(d) for name in referenced for d in segments.get(name, [])}
+    grace_cutoff = time.time() - SEGMENT_GRACE_SECONDS
+    for name in os.listdir(CHROMA_DIR):
+        path = os.path.join(CHROMA_DIR, name)
+        if not os.path.isdir(path) or name in live_segments:
+            continue
+        if os.path.getmtime(path) < grace_cutoff:
+            shutil.rmtree(path)
+            removed.append(path)
+
+    db_path = os.path.join(CHROMA_DIR, "chroma.sqlite3")
+    if os.path.exists(db_path):
+        conn = sqlite3.connect(db_path)
+        try:
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+    return removed
+
+
+def export_session(session_id, archive_path):
+    """
+    Write a session to a single zip archive: stored embeddings, documents and
+    metadata of its collection, plus the docstore and images sidecars.
+    """
+    collection_name = read_collection_name(session_id)
+    if not collection_name:
+        raise StorageError(f"Unknown session_id: {session_id}", status_code=404)
+
+    collection = get_client().get_collection(collection_name)
+    data = collection.get(include=["embeddings", "documents", "metadatas"])
+    records = {
+        "ids": data["ids"],
+        "embeddings": [[float(x) for x in e] for e in data["embeddings"]],
+        "documents": data["documents"],
+        "metadatas": data["metadatas"],
+    }
+    manifest = {
+        "version": ARCHIVE_VERSION,
+        "session_id": session_id,
+        "collection_name": collection_name,
+        "collection_metadata": collection.metadata,
+        "embedding_model": EMBEDDING_MODEL,
+        "created": time.time(),
+    }
+
+    with zipfile.ZipFile(archive_path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("manifest.json", json.dumps(manifest))
+        zf.writestr("collection.json", json.dumps(records))
+        for suffix in SESSION_FILE_SUFFIXES[1:]:
+            path = session_path(session_id, suffix)
+            if os.path.exists(path):
+                zf.write(path, arcname=suffix.lstrip("_"))
+    return archive_path
+
+
+def _read_member(zf, name):
+    """Read one archive member, refusing anything that would decompress past the limit."""
+    try:
+        info = zf.getinfo(name)
+    except KeyError:
+        raise StorageError(f"Archive is missing {name}.", status_code=422)
+    if info.file_size > MAX_ARCHIVE_MEMBER_BYTES:
+        raise StorageError(f"Archive member {name} is too large.", status_code=413)
+    return zf.read(info)
+
+
+def _load_json_member(zf, name):
+    try:
+        return json.loads(_read_member(zf, name))
+    except ValueError:
+        raise StorageError(f"Archive member {name} is not valid JSON.", status_code=422)
+
+
+def _validate_records(records):
+    """Check collection.json holds equal-length lists before anything is written to Chroma."""
+    fields = ("ids", "embeddings", "documents", "metadatas")
+    if not isinstance(records, dict) or not all(isinstance(records.get(f), list) for f in fields):
+        raise StorageError("Archive collection must hold lists of " + ", ".join(fields) + ".", status_code=422)
+    if len({len(records[f]) for f in fields}) != 1:
+        raise StorageError("Archive collection lists differ in length.", status_code=422)
+
+
+@_locked
+def import_session(archive_path):
+    """
+    Restore a session from an export_session() archive, reusing the stored
+    embeddings so no embedding or LLM calls are made. Returns the session_id.
+    """
+    try:
+        zf = zipfile.ZipFile(archive_path)
+    except zipfile.BadZipFile:
+        raise StorageError("Archive is not a valid session export.", status_code=422)
+
+    with zf:
+        manifest = _load_json_member(zf, "manifest.json")
+        if not isinstance(manifest, dict):
+            raise StorageError("Archive manifest is not an object.", status_code=422)
+        if manifest.get("version") != ARCHIVE_VERSION:
+            raise StorageError(f"Unsupported archive version: {manifest.get('version')}", status_code=422)
+        if manifest.get("embedding_model") != EMBEDDING_MODEL:
+            raise StorageError(
+                f"Archive was embedded with {manifest.get('embedding_model')}, expected {EMBEDDING_MODEL}.",
+                status_code=422,
+            )
+
+        session_id = manifest.get("session_id")
+        collection_name = manifest.get("collection_name")
+        if not isinstance(session_id, str) or not SESSION_ID_PATTERN.match(session_id):
+            raise StorageError(f"Invalid session_id in archive: {session_id!r}", status_code=422)
+        if not isinstance(collection_name, str) or not collection_name \
+                or sanitize_collection_name(collection_name) != collection_name:
+            raise StorageError(f"Invalid collection_name in archive: {collection_name!r}", status_code=422)
+
+        if not isinstance(manifest.get("collection_metadata"), (dict, type(None))):
+            raise StorageError("Invalid collection_metadata in archive.", status_code=422)
+
+        records = _load_json_member(zf, "collection.json")
+        _validate_records(records)
+
+        client = get_client()
+        if read_collection_name(session_id) or collection_name in _collection_names(client):
+            raise StorageError(f"Session {session_id} already exists.", status_code=409)
+
+        os.makedirs(CHROMA_DIR, exist_ok=True)
+        collection = client.create_collection(
+            collection_name, metadata=manifest.get("collection_metadata")
+        )
+        try:
+            batch_size = client.get_max_batch_size()
+            for start in range(0, len(records["ids"]), batch_size):
+                end = start + batch_size
+                collection.add(
+                    ids=records["ids"][start:end],
+                    embeddings=records["embeddings"][start:end],
+                    documents=records["documents"][start:end],
+                    metadatas=records["metadatas"][start:end],
+                )
+            for suffix in SESSION_FILE_SUFFIXES[1:]:
+                member = suffix.lstrip("_")
+                if member in zf.namelist():
+                    with open(session_path(session_id, suffix), "wb") as f:
+                        f.write(_read_member(zf, member))
+        except Exception:
+            client.delete_collection(collection_name)
+            for suffix in SESSION_FILE_SUFFIXES[1:]:
+                path = session_path(session_id, suffix)
+                if os.path.exists(path):
+                    os.remove(path)
+            raise
+
+    # Written last: the info file is what marks the session as present
+    with open(session_path(session_id, "_info.txt"), "w") as f:
+        f.write(collection_name)
+    return session_id
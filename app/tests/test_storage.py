@@ -0,0 +1,212 @@
+import os
+import json
+import time
+import zipfile
+
+import pytest
+
+chromadb = pytest.importorskip("chromadb")
+
+import storage
+from storage import StorageError
+
+SESSION_ID = "abc12345"
+COLLECTION = "pdf-abc12345"
+
+
+@pytest.fixture
+def chroma_dir(tmp_path, monkeypatch):
+    path = tmp_path / "chroma_db"
+    path.mkdir()
+    monkeypatch.setattr(storage, "CHROMA_DIR", str(path))
+    monkeypatch.setattr(storage, "_client", None)
+    return path
+
+
+@pytest.fixture
+def no_embedding(monkeypatch):
+    """Fail the test if Chroma ever computes an embedding itself."""
+    def refuse(self, input):
+        raise AssertionError("embedding function was called")
+    monkeypatch.setattr(chromadb.api.types.DefaultEmbeddingFunction, "__call__", refuse)
+
+
+def make_session(chroma_dir, session_id=SESSION_ID, collection_name=COLLECTION, n=3):
+    collection = storage.get_client().create_collection(collection_name)
+    collection.add(
+        ids=[f"id-{i}" for i in range(n)],
+        embeddings=[[float(i), 0.5, 1.0] for i in range(n)],
+        documents=[f"summary {i}" for i in range(n)],
+        metadatas=[{"doc_id": f"doc-{i}"} for i in range(n)],
+    )
+    (chroma_dir / f"{session_id}_info.txt").write_text(collection_name)
+    (chroma_dir / f"{session_id}_docstore.json").write_text(
+        json.dumps({"documents": {"doc-0": "text"}, "image_ids": []})
+    )
+    return collection
+
+
+def age(path, seconds=storage.SEGMENT_GRACE_SECONDS + 60):
+    old = time.time() - seconds
+    os.utime(path, (old, old))
+
+
+def write_archive(path, manifest, records=None):
+    if records is None:
+        records = {"ids": [], "embeddings": [], "documents": [], "metadatas": []}
+    with zipfile.ZipFile(path, "w") as zf:
+        zf.writestr("manifest.json", json.dumps(manifest))
+        zf.writestr("collection.json", json.dumps(records))
+    return str(path)
+
+
+def valid_manifest(**overrides):
+    manifest = {
+        "version": storage.ARCHIVE_VERSION,
+        "session_id": "deadbeef",
+        "collection_name": "pdf-deadbeef",
+        "collection_metadata": None,
+        "embedding_model": storage.EMBEDDING_MODEL,
+    }
+    manifest.update(overrides)
+    return manifest
+
+
+def test_delete_rolls_back_when_collection_delete_fails(chroma_dir, monkeypatch):
+    make_session(chroma_dir)
+    client = storage.get_client()
+
+    def fail(name):
+        raise RuntimeError("chroma unavailable")
+    monkeypatch.setattr(client, "delete_collection", fail)
+
+    with pytest.raises(RuntimeError):
+        storage.delete_session(SESSION_ID)
+
+    assert (chroma_dir / f"{SESSION_ID}_info.txt").read_text() == COLLECTION
+    assert (chroma_dir / f"{SESSION_ID}_docstore.json").exists()
+    assert COLLECTION in storage._collection_names(client)
+    assert not [p for p in os.listdir(chroma_dir) if p.startswith(".trash-")]
+
+
+def test_delete_removes_collection_and_sidecars(chroma_dir):
+    make_session(chroma_dir)
+    storage.delete_session(SESSION_ID)
+    assert storage.list_sessions() == []
+    assert COLLECTION not in storage._collection_names(storage.get_client())
+
+
+def test_delete_unknown_session(chroma_dir):
+    with pytest.raises(StorageError) as exc:
+        storage.delete_session("00000000")
+    assert exc.value.status_code == 404
+
+
+def test_compact_keeps_live_sessions_and_removes_garbage(chroma_dir):
+    make_session(chroma_dir)
+    live_segments = storage._segment_dirs_by_collection()[COLLECTION]
+
+    # Collection no _info.txt points at, as left by the old loader
+    storage.get_client().create_collection("multi-model-rag-tmpq6u_7vks").add(
+        ids=["x"], embeddings=[[0.0, 0.0, 0.0]]
+    )
+    (chroma_dir / "tmpq6u_7vks_info.txt").write_text("")
+    (chroma_dir / "0badc0de_images.txt").write_text("img")
+    old_segment = chroma_dir / "11111111-2222-3333-4444-555555555555"
+    old_segment.mkdir()
+    age(old_segment)
+    old_trash = chroma_dir / ".trash-crashed"
+    old_trash.mkdir()
+    age(old_trash)
+    fresh_segment = chroma_dir / "66666666-7777-8888-9999-000000000000"
+    fresh_segment.mkdir()
+
+    storage.compact()
+
+    remaining = set(os.listdir(chroma_dir))
+    assert {f"{SESSION_ID}_info.txt", f"{SESSION_ID}_docstore.json"} <= remaining
+    assert all(os.path.isdir(d) for d in live_segments)
+    assert fresh_segment.name in remaining
+    assert "tmpq6u_7vks_info.txt" not in remaining
+    assert "0badc0de_images.txt" not in remaining
+    assert old_segment.name not in remaining
+    assert old_trash.name not in remaining
+    assert storage._collection_names(storage.get_client()) == [COLLECTION]
+
+
+def test_export_import_round_trip_reuses_embeddings(chroma_dir, tmp_path, no_embedding):
+    original = make_session(chroma_dir).get(include=["embeddings", "documents", "metadatas"])
+    archive = storage.export_session(SESSION_ID, str(tmp_path / "session.zip"))
+    storage.delete_session(SESSION_ID)
+
+    assert storage.import_session(archive) == SESSION_ID
+
+    restored = storage.get_client().get_collection(COLLECTION).get(
+        include=["embeddings", "documents", "metadatas"]
+    )
+    assert restored["ids"] == original["ids"]
+    assert [list(e) for e in restored["embeddings"]] == [list(e) for e in original["embeddings"]]
+    assert restored["documents"] == original["documents"]
+    assert restored["metadatas"] == original["metadatas"]
+    assert json.loads((chroma_dir / f"{SESSION_ID}_docstore.json").read_text())["documents"] == {"doc-0": "text"}
+
+
+def test_import_batches_large_collections(chroma_dir, tmp_path, monkeypatch, no_embedding):
+    monkeypatch.setattr(storage.get_client(), "get_max_batch_size", lambda: 2)
+    n = 5
+    records = {
+        "ids": [str(i) for i in range(n)],
+        "embeddings": [[float(i), 0.0, 0.0] for i in range(n)],
+        "documents": ["doc"] * n,
+        "metadatas": [{"doc_id": str(i)} for i in range(n)],
+    }
+    storage.import_session(write_archive(tmp_path / "a.zip", valid_manifest(), records))
+    assert storage.get_client().get_collection("pdf-deadbeef").count() == n
+
+
+@pytest.mark.parametrize("overrides", [
+    {"session_id": "../escaped"},
+    {"session_id": "ABC12345"},
+    {"collection_name": "../bad"},
+    {"collection_name": "ab"},
+])
+def test_import_rejects_invalid_names(chroma_dir, tmp_path, overrides):
+    archive = write_archive(tmp_path / "a.zip", valid_manifest(**overrides))
+    with pytest.raises(StorageError) as exc:
+        storage.import_session(archive)
+    assert exc.value.status_code == 422
+    assert os.listdir(chroma_dir) == []
+    assert not (tmp_path / "escaped_info.txt").exists()
+
+
+def test_import_rejects_mismatched_records(chroma_dir, tmp_path):
+    records = {"ids": ["1", "2"], "embeddings": [[0.0]], "documents": ["a", "b"], "metadatas": [{}, {}]}
+    archive = write_archive(tmp_path / "a.zip", valid_manifest(), records)
+    with pytest.raises(StorageError) as exc:
+        storage.import_session(archive)
+    assert exc.value.status_code == 422
+    assert "pdf-deadbeef" not in storage._collection_names(storage.get_client())
+
+
+def test_import_rejects_oversized_members(chroma_dir, tmp_path, monkeypatch):
+    monkeypatch.setattr(storage, "MAX_ARCHIVE_MEMBER_BYTES", 10)
+    archive = write_archive(tmp_path / "a.zip", valid_manifest())
+    with pytest.raises(StorageError) as exc:
+        storage.import_session(archive)
+    assert exc.value.status_code == 413
+
+
+def test_import_rejects_existing_session(chroma_dir, tmp_path):
+    make_session(chroma_dir)
+    archive = storage.export_session(SESSION_ID, str(tmp_path / "session.zip"))
+    with pytest.raises(StorageError) as exc:
+        storage.import_session(archive)
+    assert exc.value.status_code == 409
+
+
+def test_list_sessions_reports_size(chroma_dir):
+    make_session(chroma_dir)
+    [session] = storage.list_sessions()
+    assert session["session_id"] == SESSION_ID
+    assert session["collection_name"] == COLLECTION
+    assert session["size_bytes"] > 0
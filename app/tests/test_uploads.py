@@ -0,0 +1,105 @@
+import io
+import asyncio
+import hashlib
+
+import pytest
+from pypdf import PdfWriter
+
+import uploads
+from uploads import UploadRejected
+
+
+def make_pdf(pages=1):
+    writer = PdfWriter()
+    for _ in range(pages):
+        writer.add_blank_page(width=72, height=72)
+    buf = io.BytesIO()
+    writer.write(buf)
+    return buf.getvalue()
+
+
+def test_content_length_within_limit():
+    uploads.check_content_length({"content-length": "1000"}, max_bytes=1000)
+
+
+def test_content_length_allows_multipart_overhead():
+    limit = 1000 + uploads.MULTIPART_OVERHEAD_BYTES
+    uploads.check_content_length({"content-length": str(limit)}, max_bytes=1000)
+
+
+def test_content_length_over_limit():
+    limit = 1000 + uploads.MULTIPART_OVERHEAD_BYTES + 1
+    with pytest.raises(UploadRejected) as exc:
+        uploads.check_content_length({"content-length": str(limit)}, max_bytes=1000)
+    assert exc.value.status_code == 413
+
+
+def test_content_length_missing():
+    with pytest.raises(UploadRejected) as exc:
+        uploads.check_content_length({}, max_bytes=1000)
+    assert exc.value.status_code == 411
+
+
+def test_content_length_invalid():
+    with pytest.raises(UploadRejected) as exc:
+        uploads.check_content_length({"content-length": "abc"}, max_bytes=1000)
+    assert exc.value.status_code == 400
+
+
+def test_hash_fileobj_valid_pdf_is_hashed_and_rewound():
+    data = make_pdf()
+    fileobj = io.BytesIO(data)
+    digest, size = uploads._hash_fileobj(fileobj, max_bytes=len(data))
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert size == len(data)
+    assert fileobj.tell() == 0
+
+
+def test_hash_fileobj_not_a_pdf():
+    with pytest.raises(UploadRejected) as exc:
+        uploads._hash_fileobj(io.BytesIO(b"hello world"), max_bytes=1000)
+    assert exc.value.status_code == 415
+
+
+def test_hash_fileobj_empty():
+    with pytest.raises(UploadRejected) as exc:
+        uploads._hash_fileobj(io.BytesIO(b""), max_bytes=1000)
+    assert exc.value.status_code == 400
+
+
+def test_hash_fileobj_over_limit():
+    data = make_pdf()
+    with pytest.raises(UploadRejected) as exc:
+        uploads._hash_fileobj(io.BytesIO(data), max_bytes=len(data) - 1)
+    assert exc.value.status_code == 413
+
+
+def test_page_limit_within_limit():
+    fileobj = io.BytesIO(make_pdf(pages=2))
+    assert asyncio.run(uploads.check_page_limit(fileobj, max_pages=2)) == 2
+    assert fileobj.tell() == 0
+
+
+def test_page_limit_exceeded():
+    with pytest.raises(UploadRejected) as exc:
+        asyncio.run(uploads.check_page_limit(io.BytesIO(make_pdf(pages=3)), max_pages=2))
+    assert exc.value.status_code == 413
+
+
+def test_page_limit_unreadable_pdf():
+    with pytest.raises(UploadRejected) as exc:
+        asyncio.run(uploads.check_page_limit(io.BytesIO(b"%PDF-garbage"), max_pages=2))
+    assert exc.value.status_code == 422
+
+
+def test_spooled_upload_path_reads_the_spool_file():
+    from tempfile import SpooledTemporaryFile
+    from starlette.datastructures import UploadFile
+
+    data = make_pdf()
+    spool = SpooledTemporaryFile(max_size=1024 * 1024)
+    spool.write(data)
+    spool.seek(0)
+    path = uploads.spooled_upload_path(UploadFile(spool, filename="a.pdf"))
+    with open(path, "rb") as f:
+        assert f.read() == data
@@ -0,0 +1,123 @@
+import os
+import hashlib
+from starlette.concurrency import run_in_threadpool
+
+# Upload limits, configurable through the environment
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
+MAX_PDF_PAGES = int(os.getenv("MAX_PDF_PAGES", "300"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Allowance for multipart boundaries and the small form fields sent with the file
+MULTIPART_OVERHEAD_BYTES = 64 * 1024
+
+PDF_MAGIC = b"%PDF-"
+
+
+class UploadRejected(Exception):
+    """Raised when an upload fails validation; carries the HTTP status to return."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _too_large(max_bytes):
+    return UploadRejected(
+        f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit.", status_code=413
+    )
+
+
+def check_content_length(headers, max_bytes=None):
+    """
+    Reject a request from its Content-Length header, before any of the body is read.
+    Requests without one (chunked uploads) are refused, since their size is unknown
+    until Starlette has already spooled the whole body to disk.
+    """
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    content_length = headers.get("content-length")
+    if content_length is None:
+        raise UploadRejected("Uploads must send a Content-Length header.", status_code=411)
+    try:
+        content_length = int(content_length)
+    except ValueError:
+        raise UploadRejected("Invalid Content-Length header.")
+    if content_length > max_bytes + MULTIPART_OVERHEAD_BYTES:
+        raise _too_large(max_bytes)
+
+
+def count_pdf_pages(fileobj):
+    """Count pages by parsing the page tree only, without rendering or extracting content."""
+    from pypdf import PdfReader
+    fileobj.seek(0)
+    try:
+        return len(PdfReader(fileobj).pages)
+    finally:
+        fileobj.seek(0)
+
+
+def _hash_fileobj(fileobj, max_bytes):
+    fileobj.seek(0)
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = fileobj.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        if size == 0 and not chunk.startswith(PDF_MAGIC):
+            raise UploadRejected("Uploaded file is not a PDF.", status_code=415)
+        size += len(chunk)
+        if size > max_bytes:
+            raise _too_large(max_bytes)
+        digest.update(chunk)
+    fileobj.seek(0)
+    if size == 0:
+        raise UploadRejected("Uploaded file is empty.")
+    return digest.hexdigest(), size
+
+
+async def hash_upload(upload_file, max_bytes=None):
+    """
+    Validate and SHA-256 hash an UploadFile in place, in the file Starlette
+    already spooled it to, without making another copy. Returns (sha256_hex, size)
+    and leaves the file rewound for the pipeline.
+    """
+    max_bytes = MAX_UPLOAD_BYTES if max_bytes is None else max_bytes
+    if upload_file.size is not None and upload_file.size > max_bytes:
+        raise _too_large(max_bytes)
+    return await run_in_threadpool(_hash_fileobj, upload_file.file, max_bytes)
+
+
+def spooled_upload_path(upload_file):
+    """
+    Move Starlette's spooled upload onto disk and return a path to it, so
+    unstructured and pdf2image read the spool file instead of copying the stream.
+    On Linux the spool file is unnamed, so it is reached through /proc.
+    Returns None when no path is available.
+    """
+    spool = upload_file.file
+    if hasattr(spool, "rollover"):
+        spool.rollover()
+    name = getattr(spool, "name", None)
+    if isinstance(name, str) and os.path.exists(name):
+        return name
+    if isinstance(name, int):
+        # /proc/<pid> rather than /proc/self so child processes like pdftoppm can open it
+        proc_path = f"/proc/{os.getpid()}/fd/{name}"
+        if os.path.exists(proc_path):
+            return proc_path
+    return None
+
+
+async def check_page_limit(fileobj, max_pages=None):
+    """Reject PDFs over the page limit before the expensive partition step."""
+    max_pages = MAX_PDF_PAGES if max_pages is None else max_pages
+    try:
+        pages = await run_in_threadpool(count_pdf_pages, fileobj)
+    except Exception as e:
+        raise UploadRejected(f"Could not read PDF: {e}", status_code=422)
+    if pages > max_pages:
+        raise UploadRejected(
+            f"PDF has {pages} pages; the limit is {max_pages}.", status_code=413
+        )
+    return pages